@@ -1,9 +1,40 @@
 from sqlalchemy.orm import Session
 from . import models, schemas
-from geoalchemy2.shape import from_shape
+from .database import lock_change_log
+from .tiles import invalidate_tiles
+from geoalchemy2.shape import from_shape, to_shape
 from shapely.geometry import shape
 import json
 
+# Every write takes lock_change_log before the row is read or flushed, so concurrent writes
+# to the same row apply one after the other.
+
+def record_change(db: Session, entity: str, entity_id: int, operation: str, payload: dict):
+    db.add(models.ChangeLog(
+        entity=entity,
+        entity_id=entity_id,
+        operation=operation,
+        payload=json.dumps(payload)
+    ))
+
+def provider_payload(db_provider: models.Provider):
+    payload = {'id': db_provider.id}
+    for key in schemas.ProviderBase.__fields__:
+        payload[key] = getattr(db_provider, key)
+    return payload
+
+def service_area_payload(db_service_area: models.ServiceArea):
+    return schemas.ServiceArea.from_orm(db_service_area).dict()
+
+def get_changes(db: Session, since: int = 0, limit: int = 100):
+    return (
+        db.query(models.ChangeLog)
+        .filter(models.ChangeLog.seq > since)
+        .order_by(models.ChangeLog.seq)
+        .limit(limit)
+        .all()
+    )
+
 def get_provider(db: Session, provider_id: int):
     return db.query(models.Provider).filter(models.Provider.id == provider_id).first()
 
@@ -11,26 +42,37 @@ def get_providers(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Provider).offset(skip).limit(limit).all()
 
 def create_provider(db: Session, provider: schemas.ProviderCreate):
+    lock_change_log(db)
     db_provider = models.Provider(**provider.dict())
     db.add(db_provider)
+    db.flush()
+    record_change(db, 'provider', db_provider.id, 'create', provider_payload(db_provider))
     db.commit()
     db.refresh(db_provider)
     return db_provider
 
 def update_provider(db: Session, provider_id: int, provider: schemas.ProviderCreate):
+    lock_change_log(db)
     db_provider = get_provider(db, provider_id)
     if db_provider is None:
         return None
     for key, value in provider.dict().items():
         setattr(db_provider, key, value)
+    record_change(db, 'provider', db_provider.id, 'update', provider_payload(db_provider))
     db.commit()
     db.refresh(db_provider)
     return db_provider
 
 def delete_provider(db: Session, provider_id: int):
+    lock_change_log(db)
     db_provider = get_provider(db, provider_id)
     if db_provider is None:
         return None
+    bboxes = [service_area_bbox(service_area) for service_area in db_provider.service_areas]
+    for db_service_area in db_provider.service_areas:
+        record_change(db, 'service_area', db_service_area.id, 'delete', service_area_payload(db_service_area))
+    record_change(db, 'provider', db_provider.id, 'delete', provider_payload(db_provider))
+    invalidate_tiles(db, *bboxes)
     db.delete(db_provider)
     db.commit()
     return db_provider
@@ -38,6 +80,11 @@ def delete_provider(db: Session, provider_id: int):
 def get_service_area(db: Session, service_area_id: int):
     return db.query(models.ServiceArea).filter(models.ServiceArea.id == service_area_id).first()
 
+def service_area_bbox(db_service_area: models.ServiceArea):
+    if db_service_area.geojson is None:
+        return None
+    return to_shape(db_service_area.geojson).bounds
+
 def get_service_areas(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.ServiceArea).offset(skip).limit(limit).all()
 
@@ -52,15 +99,21 @@ def create_service_area(db: Session, service_area: schemas.ServiceAreaCreate, pr
         provider_id=provider_id,
         geojson=from_shape(geo_shape, srid=4326)
     )
+    lock_change_log(db)
     db.add(db_service_area)
+    db.flush()
+    record_change(db, 'service_area', db_service_area.id, 'create', service_area_payload(db_service_area))
+    invalidate_tiles(db, geo_shape.bounds)
     db.commit()
     db.refresh(db_service_area)
     return db_service_area
 
 def update_service_area(db: Session, service_area_id: int, service_area: schemas.ServiceAreaCreate):
+    lock_change_log(db)
     db_service_area = get_service_area(db, service_area_id)
     if db_service_area is None:
         return None
+    old_bbox = service_area_bbox(db_service_area)
     for key, value in service_area.dict().items():
         if key == 'geojson':
             try:
@@ -70,14 +123,20 @@ def update_service_area(db: Session, service_area_id: int, service_area: schemas
                 raise ValueError("Invalid GeoJSON format")
         else:
             setattr(db_service_area, key, value)
+    record_change(db, 'service_area', db_service_area.id, 'update', service_area_payload(db_service_area))
+    invalidate_tiles(db, old_bbox, service_area_bbox(db_service_area))
     db.commit()
     db.refresh(db_service_area)
     return db_service_area
 
 def delete_service_area(db: Session, service_area_id: int):
+    lock_change_log(db)
     db_service_area = get_service_area(db, service_area_id)
     if db_service_area is None:
         return None
+    bbox = service_area_bbox(db_service_area)
+    record_change(db, 'service_area', db_service_area.id, 'delete', service_area_payload(db_service_area))
+    invalidate_tiles(db, bbox)
     db.delete(db_service_area)
     db.commit()
     return db_service_area
@@ -1,13 +1,25 @@
-from fastapi import FastAPI, Depends, HTTPException
+import asyncio
+import math
+from fastapi import FastAPI, Depends, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List
 from geoalchemy2.functions import ST_Contains
-from . import crud, models, schemas
+from . import crud, models, schemas, tiles
 from .database import engine, get_db
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import func
+from sqlalchemy import func, text
 
-models.Base.metadata.create_all(bind=engine)
+SCHEMA_LOCK_KEY = 7260128
+
+# Every uvicorn worker imports this module; the lock keeps them from racing to create the same tables.
+with engine.begin() as conn:
+    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': SCHEMA_LOCK_KEY})
+    models.Base.metadata.create_all(bind=conn)
+
+CHANGES_MAX_TIMEOUT = 30.0
+CHANGES_POLL_INTERVAL = 0.5
+CHANGES_MAX_LIMIT = 1000
 
 app = FastAPI(title="Service Area API")
 
@@ -104,3 +116,31 @@ def search_service_areas(lat: float, lng: float, db: Session = Depends(get_db)):
             'price': service_area.price
         })
     return results
+
+@app.get("/tiles/{z}/{x}/{y}")
+def read_tile(z: int, x: int, y: int, db: Session = Depends(get_db)):
+    if not tiles.is_valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="Tile not found")
+    tile = tiles.get_tile(db, z, x, y)
+    return Response(content=tile, media_type=tiles.MVT_MEDIA_TYPE)
+
+@app.get("/changes/", response_model=schemas.ChangeFeed)
+async def read_changes(
+    since: int = 0,
+    limit: int = Query(100, ge=1, le=CHANGES_MAX_LIMIT),
+    timeout: float = Query(0, ge=0, le=CHANGES_MAX_TIMEOUT),
+    db: Session = Depends(get_db)
+):
+    if not math.isfinite(timeout):
+        raise HTTPException(status_code=422, detail="Timeout must be a finite number")
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        changes = await run_in_threadpool(crud.get_changes, db, since=since, limit=limit)
+        if changes or loop.time() >= deadline:
+            break
+        # Hand the connection back to the pool while waiting for new changes.
+        await run_in_threadpool(db.close)
+        await asyncio.sleep(CHANGES_POLL_INTERVAL)
+    last_seq = changes[-1].seq if changes else since
+    return {'changes': changes, 'last_seq': last_seq}
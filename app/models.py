@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text, func
 from sqlalchemy.orm import relationship
 from geoalchemy2 import Geometry
 from .database import Base
@@ -25,3 +25,23 @@ class ServiceArea(Base):
     geojson = Column(Geometry('POLYGON', srid=4326), nullable=False)
 
     provider = relationship("Provider", back_populates="service_areas")
+
+class ChangeLog(Base):
+    __tablename__ = 'change_log'
+
+    seq = Column(Integer, primary_key=True, index=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+class TileInvalidation(Base):
+    __tablename__ = 'tile_invalidations'
+
+    seq = Column(Integer, primary_key=True, index=True)
+    min_lng = Column(Float, nullable=False)
+    min_lat = Column(Float, nullable=False)
+    max_lng = Column(Float, nullable=False)
+    max_lat = Column(Float, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field, validator
+from datetime import datetime
 from typing import List
 from geoalchemy2.elements import WKBElement
 from geoalchemy2.shape import to_shape
@@ -43,3 +44,24 @@ class Provider(ProviderBase):
 
     class Config:
         orm_mode = True
+
+class Change(BaseModel):
+    seq: int
+    entity: str
+    entity_id: int
+    operation: str
+    payload: dict
+    created_at: datetime
+
+    @validator('payload', pre=True)
+    def payload_to_dict(cls, v):
+        if isinstance(v, str):
+            return json.loads(v)
+        return v
+
+    class Config:
+        orm_mode = True
+
+class ChangeFeed(BaseModel):
+    changes: List[Change]
+    last_seq: int
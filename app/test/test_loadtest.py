@@ -0,0 +1,86 @@
+# app/test/test_loadtest.py
+
+import asyncio
+import random
+import httpx
+from loadtest.run import (
+    StepStats, Traffic, compare_reports, parse_steps, percentile, sample_db, saturation_flags, send
+)
+
+def make_step(target_rps, achieved_rps, error_rate=0.0, p99=50.0, peak_in_flight=5, dropped=0, db_connections=None):
+    step = {
+        'target_rps': target_rps,
+        'achieved_rps': achieved_rps,
+        'error_rate': error_rate,
+        'dropped': dropped,
+        'peak_in_flight': peak_in_flight,
+        'latency_ms': {'p50': p99 / 2, 'p90': p99, 'p99': p99, 'max': p99},
+    }
+    if db_connections is not None:
+        step['db_connections'] = {'peak_total': db_connections, 'peak_active': db_connections}
+    return step
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([], 50) is None
+
+def test_percentile_nearest_rank():
+    assert percentile([1, 2, 3, 4, 5], 50) == 3
+    assert percentile([5, 1, 4, 2, 3], 90) == 5
+    assert percentile(list(range(1, 151)), 99) == 149
+    assert percentile(list(range(1, 8)), 50) == 4
+    assert percentile([7], 99) == 7
+
+def test_parse_steps():
+    assert parse_steps("10,25,50.5") == [10, 25, 50.5]
+
+def test_saturation_flags_healthy_step():
+    step = make_step(100, 99.0, db_connections=3)
+    assert saturation_flags(step, pool_capacity=15, thread_capacity=40) == []
+
+def test_saturation_flags_pool_exhaustion():
+    step = make_step(200, 120.0, error_rate=0.05, peak_in_flight=80, db_connections=15)
+    flags = saturation_flags(step, pool_capacity=15, thread_capacity=40)
+    assert flags == ['throughput', 'errors', 'pool_exhaustion']
+
+def test_saturation_flags_thread_starvation():
+    step = make_step(200, 150.0, peak_in_flight=40, db_connections=4)
+    flags = saturation_flags(step, pool_capacity=15, thread_capacity=40)
+    assert flags == ['throughput', 'thread_starvation']
+
+def test_saturation_flags_unknown_cause_without_db_samples():
+    step = make_step(200, 150.0, peak_in_flight=40)
+    flags = saturation_flags(step, pool_capacity=15, thread_capacity=40)
+    assert flags == ['throughput', 'unknown_cause']
+
+def test_compare_reports():
+    baseline = {'steps': [make_step(10, 10.0, p99=40.0), make_step(50, 49.5, p99=80.0)]}
+    report = {'steps': [make_step(10, 10.0, p99=50.0), make_step(100, 60.0)]}
+    lines = compare_reports(report, baseline)
+    assert len(lines) == 1
+    assert "p99 40.0ms -> 50.0ms (+25%)" in lines[0]
+
+def test_sample_db_unreachable_database():
+    stats = StepStats(10, 1)
+    stop = asyncio.Event()
+    result = asyncio.run(sample_db("postgresql://postgres@127.0.0.1:1/postgres", stats, stop, 0.1))
+    assert result is False
+    assert stats.db_samples == []
+
+def test_send_records_invalid_response():
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text="not json"))
+    traffic = Traffic(random.Random(0), write_ratio=1.0)
+    traffic.provider_ids = [1]
+    stats = StepStats(10, 1)
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await send(client, traffic, stats, timeout=1)
+
+    asyncio.run(run())
+    assert stats.in_flight == 0
+    assert stats.errors == {'create_service_area': {'invalid_response': 1}}
+    assert len(stats.latencies['create_service_area']) == 1
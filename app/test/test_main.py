@@ -5,8 +5,13 @@ from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from app.database import Base, get_db
 from app.main import app
+from app import crud, models, schemas
+from app import main as main_module
+from app.tiles import TILE_INVALIDATION_RETENTION, tile_cache, tile_range
+from datetime import datetime, timezone
 import pytest
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -71,6 +76,7 @@ def db_session():
 
     # Override the get_db dependency to use this session
     app.dependency_overrides[get_db] = lambda: db
+    tile_cache.clear()
 
     yield
 
@@ -419,3 +425,274 @@ def test_get_nonexistent_service_area():
     assert response.status_code == 404
     data = response.json()
     assert data["detail"] == "Service Area not found"
+
+# Tiles Endpoint
+
+def test_get_tile():
+    # Create a provider and service area
+    response = client.post(
+        "/providers/",
+        json={
+            "name": "Tile Provider",
+            "email": "tileprovider@example.com",
+            "phone_number": "1212121212",
+            "language": "English",
+            "currency": "USD"
+        }
+    )
+    provider_id = response.json()["id"]
+
+    response = client.post(
+        f"/providers/{provider_id}/service_areas/",
+        json={
+            "name": "Tile Service Area",
+            "price": 450.0,
+            "geojson": "{\"type\": \"Polygon\", \"coordinates\": [[[10, 10], [10, 20], [20, 20], [20, 10], [10, 10]]]}"
+        }
+    )
+    assert response.status_code == 200
+
+    response = client.get("/tiles/0/0/0")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.mapbox-vector-tile"
+    assert b"service_areas" in response.content
+    assert (0, 0, 0) in tile_cache
+
+def test_tile_cache_invalidated_on_service_area_update():
+    # Create a provider and service area
+    response = client.post(
+        "/providers/",
+        json={
+            "name": "Tile Invalidation Provider",
+            "email": "tileinvalidation@example.com",
+            "phone_number": "1313131313",
+            "language": "English",
+            "currency": "USD"
+        }
+    )
+    provider_id = response.json()["id"]
+
+    response = client.post(
+        f"/providers/{provider_id}/service_areas/",
+        json={
+            "name": "Tile Invalidation Service Area",
+            "price": 500.0,
+            "geojson": "{\"type\": \"Polygon\", \"coordinates\": [[[10, 10], [10, 20], [20, 20], [20, 10], [10, 10]]]}"
+        }
+    )
+    service_area_id = response.json()["id"]
+
+    # Warm a tile covering the service area and one on the other side of the world
+    assert client.get("/tiles/1/1/0").status_code == 200
+    assert client.get("/tiles/1/0/1").status_code == 200
+
+    response = client.put(
+        f"/service_areas/{service_area_id}",
+        json={
+            "name": "Tile Invalidation Service Area",
+            "price": 550.0,
+            "geojson": "{\"type\": \"Polygon\", \"coordinates\": [[[10, 10], [10, 20], [20, 20], [20, 10], [10, 10]]]}"
+        }
+    )
+    assert response.status_code == 200
+
+    # Any tile request picks up invalidations written by this or another worker
+    assert client.get("/tiles/1/0/1").status_code == 200
+    assert (1, 1, 0) not in tile_cache
+    assert (1, 0, 1) in tile_cache
+
+def test_old_tile_invalidations_are_pruned():
+    db = app.dependency_overrides[get_db]()
+    old = models.TileInvalidation(
+        min_lng=0, min_lat=0, max_lng=1, max_lat=1,
+        created_at=datetime.now(timezone.utc) - 2 * TILE_INVALIDATION_RETENTION
+    )
+    db.add(old)
+    db.commit()
+    old_seq = old.seq
+
+    # Any service area write prunes expired invalidations
+    response = client.post(
+        "/providers/",
+        json={
+            "name": "Prune Provider",
+            "email": "pruneprovider@example.com",
+            "phone_number": "1818181818",
+            "language": "English",
+            "currency": "USD"
+        }
+    )
+    provider_id = response.json()["id"]
+    response = client.post(
+        f"/providers/{provider_id}/service_areas/",
+        json={
+            "name": "Prune Service Area",
+            "price": 100.0,
+            "geojson": "{\"type\": \"Polygon\", \"coordinates\": [[[6, 6], [6, 7], [7, 7], [7, 6], [6, 6]]]}"
+        }
+    )
+    assert response.status_code == 200
+    seqs = [row.seq for row in db.query(models.TileInvalidation).all()]
+    assert old_seq not in seqs
+    assert len(seqs) >= 1
+
+def test_tile_cache_reset_after_long_idle():
+    assert client.get("/tiles/0/0/0").status_code == 200
+    tile_cache.set((3, 3, 3), b"stale")
+
+    # A worker idle for longer than half the retention may have missed pruned invalidations
+    tile_cache.synced_at = time.monotonic() - TILE_INVALIDATION_RETENTION.total_seconds()
+    assert client.get("/tiles/0/0/0").status_code == 200
+    assert (3, 3, 3) not in tile_cache
+    assert (0, 0, 0) in tile_cache
+
+def test_get_tile_out_of_range():
+    response = client.get("/tiles/1/2/0")
+    assert response.status_code == 404
+    data = response.json()
+    assert data["detail"] == "Tile not found"
+
+def test_tile_range():
+    assert tile_range((10, 10, 20, 20), 0) == (0, 0, 0, 0)
+    assert tile_range((10, 10, 20, 20), 1) == (1, 0, 1, 0)
+    assert tile_range((-180, -85, 180, 85), 2) == (0, 0, 3, 3)
+
+# Change Feed Endpoint
+
+def test_changes_feed_records_writes():
+    # Create a provider and service area, update the area and delete the provider
+    response = client.post(
+        "/providers/",
+        json={
+            "name": "Change Feed Provider",
+            "email": "changefeed@example.com",
+            "phone_number": "1414141414",
+            "language": "English",
+            "currency": "USD"
+        }
+    )
+    provider_id = response.json()["id"]
+
+    response = client.post(
+        f"/providers/{provider_id}/service_areas/",
+        json={
+            "name": "Change Feed Service Area",
+            "price": 600.0,
+            "geojson": "{\"type\": \"Polygon\", \"coordinates\": [[[4, 4], [4, 5], [5, 5], [5, 4], [4, 4]]]}"
+        }
+    )
+    service_area_id = response.json()["id"]
+
+    response = client.put(
+        f"/service_areas/{service_area_id}",
+        json={
+            "name": "Change Feed Service Area",
+            "price": 650.0,
+            "geojson": "{\"type\": \"Polygon\", \"coordinates\": [[[4, 4], [4, 5], [5, 5], [5, 4], [4, 4]]]}"
+        }
+    )
+    assert response.status_code == 200
+
+    response = client.delete(f"/providers/{provider_id}")
+    assert response.status_code == 200
+
+    response = client.get("/changes/")
+    assert response.status_code == 200
+    data = response.json()
+    changes = [(c["entity"], c["entity_id"], c["operation"]) for c in data["changes"]]
+    assert changes == [
+        ("provider", provider_id, "create"),
+        ("service_area", service_area_id, "create"),
+        ("service_area", service_area_id, "update"),
+        ("service_area", service_area_id, "delete"),
+        ("provider", provider_id, "delete"),
+    ]
+    assert data["changes"][2]["payload"]["price"] == 650.0
+    assert data["last_seq"] == data["changes"][-1]["seq"]
+
+def test_changes_feed_resumes_from_seq():
+    response = client.post(
+        "/providers/",
+        json={
+            "name": "First Feed Provider",
+            "email": "firstfeed@example.com",
+            "phone_number": "1515151515",
+            "language": "English",
+            "currency": "USD"
+        }
+    )
+    assert response.status_code == 200
+    last_seq = client.get("/changes/").json()["last_seq"]
+
+    response = client.post(
+        "/providers/",
+        json={
+            "name": "Second Feed Provider",
+            "email": "secondfeed@example.com",
+            "phone_number": "1616161616",
+            "language": "English",
+            "currency": "USD"
+        }
+    )
+    second_id = response.json()["id"]
+
+    response = client.get(f"/changes/?since={last_seq}")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["changes"]) == 1
+    assert data["changes"][0]["entity_id"] == second_id
+    assert data["changes"][0]["payload"]["name"] == "Second Feed Provider"
+
+    # Nothing new after the last sequence number
+    response = client.get(f"/changes/?since={data['last_seq']}")
+    data_after = response.json()
+    assert data_after["changes"] == []
+    assert data_after["last_seq"] == data["last_seq"]
+
+def test_changes_long_poll_times_out_without_changes(monkeypatch):
+    monkeypatch.setattr(main_module, "CHANGES_POLL_INTERVAL", 0.05)
+    since = client.get("/changes/").json()["last_seq"]
+
+    started = time.monotonic()
+    response = client.get(f"/changes/?since={since}&timeout=0.3")
+    elapsed = time.monotonic() - started
+    assert response.status_code == 200
+    data = response.json()
+    assert data["changes"] == []
+    assert data["last_seq"] == since
+    assert elapsed >= 0.3
+
+def test_changes_long_poll_returns_change_made_while_waiting(monkeypatch):
+    monkeypatch.setattr(main_module, "CHANGES_POLL_INTERVAL", 0.05)
+    since = client.get("/changes/").json()["last_seq"]
+
+    # Write a provider between the first and second poll of the feed
+    get_changes = crud.get_changes
+    calls = []
+    def get_changes_with_write(db, since, limit):
+        calls.append(since)
+        if len(calls) == 2:
+            crud.create_provider(db, schemas.ProviderCreate(
+                name="Long Poll Provider",
+                email="longpoll@example.com",
+                phone_number="1717171717",
+                language="English",
+                currency="USD"
+            ))
+        return get_changes(db, since=since, limit=limit)
+    monkeypatch.setattr(crud, "get_changes", get_changes_with_write)
+
+    response = client.get(f"/changes/?since={since}&timeout=5")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(calls) == 2
+    assert len(data["changes"]) == 1
+    assert data["changes"][0]["payload"]["name"] == "Long Poll Provider"
+    assert data["last_seq"] == data["changes"][0]["seq"]
+
+def test_changes_invalid_parameters():
+    assert client.get("/changes/?timeout=nan").status_code == 422
+    assert client.get("/changes/?timeout=-1").status_code == 422
+    assert client.get("/changes/?timeout=31").status_code == 422
+    assert client.get("/changes/?limit=0").status_code == 422
+    assert client.get("/changes/?limit=5000").status_code == 422
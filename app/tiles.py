@@ -0,0 +1,211 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+from . import models
+from .database import lock_change_log
+
+MAX_ZOOM = 22
+TILE_EXTENT = 4096
+TILE_CACHE_SIZE = 2048
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+WEB_MERCATOR_WIDTH = 2 * math.pi * 6378137
+MAX_LATITUDE = 85.0511287798066
+
+# Invalidations older than this are pruned. A worker that has not synced for half of it drops its whole cache.
+TILE_INVALIDATION_RETENTION = timedelta(hours=1)
+
+TILE_QUERY = text(f"""
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(:z, :x, :y) AS geom
+    ),
+    mvtgeom AS (
+        SELECT
+            ST_AsMVTGeom(
+                ST_SimplifyPreserveTopology(
+                    ST_Transform(
+                        ST_ClipByBox2D(sa.geojson, ST_MakeEnvelope(-180, -{MAX_LATITUDE}, 180, {MAX_LATITUDE}, 4326)),
+                        3857
+                    ),
+                    :tolerance
+                ),
+                bounds.geom,
+                :extent
+            ) AS geom,
+            sa.id,
+            sa.name,
+            sa.price,
+            sa.provider_id
+        FROM service_areas sa, bounds
+        WHERE ST_Intersects(sa.geojson, ST_Transform(bounds.geom, 4326))
+    )
+    SELECT ST_AsMVT(mvtgeom.*, 'service_areas', :extent, 'geom')
+    FROM mvtgeom
+    WHERE mvtgeom.geom IS NOT NULL
+""")
+
+def is_valid_tile(z: int, x: int, y: int):
+    if z < 0 or z > MAX_ZOOM:
+        return False
+    n = 1 << z
+    return 0 <= x < n and 0 <= y < n
+
+def lng_to_tile_x(lng: float, z: int):
+    n = 1 << z
+    x = int((lng + 180.0) / 360.0 * n)
+    return min(max(x, 0), n - 1)
+
+def lat_to_tile_y(lat: float, z: int):
+    n = 1 << z
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(y, 0), n - 1)
+
+def tile_range(bbox, z: int):
+    min_lng, min_lat, max_lng, max_lat = bbox
+    return (
+        lng_to_tile_x(min_lng, z),
+        lat_to_tile_y(max_lat, z),
+        lng_to_tile_x(max_lng, z),
+        lat_to_tile_y(min_lat, z),
+    )
+
+def simplify_tolerance(z: int):
+    # One pixel of the tile grid in EPSG:3857 metres; finer detail is lost by ST_AsMVTGeom anyway.
+    return WEB_MERCATOR_WIDTH / (1 << z) / TILE_EXTENT
+
+class TileCache:
+    def __init__(self, max_size: int = TILE_CACHE_SIZE):
+        self.max_size = max_size
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.synced_seq = None
+        self.synced_at = None
+
+    def get(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+            return tile
+
+    def set(self, key, tile: bytes, generation: int = None):
+        with self._lock:
+            # A write landed while this tile was rendering; the tile may be stale.
+            if generation is not None and generation != self.generation:
+                return
+            self._tiles[key] = tile
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_size:
+                self._tiles.popitem(last=False)
+
+    def invalidate_bbox(self, bbox):
+        with self._lock:
+            ranges = {}
+            stale = []
+            for key in self._tiles:
+                z, x, y = key
+                if z not in ranges:
+                    ranges[z] = tile_range(bbox, z)
+                min_x, min_y, max_x, max_y = ranges[z]
+                if min_x <= x <= max_x and min_y <= y <= max_y:
+                    stale.append(key)
+            for key in stale:
+                del self._tiles[key]
+            self.generation += 1
+            return len(stale)
+
+    def advance(self, seq: int):
+        with self._lock:
+            self.synced_seq = max(self.synced_seq or 0, seq)
+            self.synced_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self._tiles.clear()
+            self.generation += 1
+            self.synced_seq = None
+            self.synced_at = None
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self.generation += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._tiles
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tiles)
+
+tile_cache = TileCache()
+
+def invalidate_tiles(db: Session, *bboxes):
+    # Invalidations go through the database so that every worker's cache sees them, not just this one.
+    # The lock makes sequence numbers commit in order, so no worker skips one.
+    lock_change_log(db)
+    db.query(models.TileInvalidation).filter(
+        models.TileInvalidation.created_at < func.now() - TILE_INVALIDATION_RETENTION
+    ).delete(synchronize_session=False)
+    for bbox in bboxes:
+        if bbox is not None:
+            min_lng, min_lat, max_lng, max_lat = bbox
+            db.add(models.TileInvalidation(
+                min_lng=min_lng,
+                min_lat=min_lat,
+                max_lng=max_lng,
+                max_lat=max_lat
+            ))
+
+def sync_invalidations(db: Session):
+    synced_at = tile_cache.synced_at
+    if synced_at is not None and time.monotonic() - synced_at > TILE_INVALIDATION_RETENTION.total_seconds() / 2:
+        # Invalidations this worker has not seen may already be pruned.
+        tile_cache.reset()
+    if tile_cache.synced_seq is None:
+        # Nothing is cached yet, so only later invalidations matter.
+        latest = db.query(func.max(models.TileInvalidation.seq)).scalar()
+        tile_cache.advance(latest or 0)
+        return
+    invalidations = (
+        db.query(models.TileInvalidation)
+        .filter(models.TileInvalidation.seq > tile_cache.synced_seq)
+        .order_by(models.TileInvalidation.seq)
+        .all()
+    )
+    for invalidation in invalidations:
+        tile_cache.invalidate_bbox((
+            invalidation.min_lng,
+            invalidation.min_lat,
+            invalidation.max_lng,
+            invalidation.max_lat,
+        ))
+    tile_cache.advance(invalidations[-1].seq if invalidations else tile_cache.synced_seq)
+
+def render_tile(db: Session, z: int, x: int, y: int):
+    result = db.execute(TILE_QUERY, {
+        'z': z,
+        'x': x,
+        'y': y,
+        'tolerance': simplify_tolerance(z),
+        'extent': TILE_EXTENT,
+    }).scalar()
+    return bytes(result) if result is not None else b''
+
+def get_tile(db: Session, z: int, x: int, y: int):
+    sync_invalidations(db)
+    key = (z, x, y)
+    tile = tile_cache.get(key)
+    if tile is None:
+        generation = tile_cache.generation
+        tile = render_tile(db, z, x, y)
+        tile_cache.set(key, tile, generation=generation)
+    return tile